@@ -1,15 +1,60 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 #
+import asyncio
+import signal
 import serial
 import minimalmodbus
 import time
 from datetime import datetime
 
+now = datetime.now
+
+# 每个串口一把锁: minimalmodbus按端口共享同一个serial.Serial对象，
+# 同一端口上的所有传感器必须通过同一把锁串行访问
+_bus_locks = {}
+
+# 寄存器映射表: (名称, 寄存器地址, 除数)，根据传感器手册调整
+REGISTER_MAP = [
+    ('temperature', 40003, 1000.0),
+    ('humidity', 40008, 1000.0),
+    ('gas', 40003, 1000.0),
+    ('fire', 2, 10.0),
+]
+
+# 相邻寄存器间隔不超过该值时合并为一次读取。默认0: 只合并地址真正连续的寄存器，
+# 不读取映射表之外的地址 (从站可能对未实现的地址返回异常码02)
+MAX_REGISTER_GAP = 0
+# Modbus单次读取保持寄存器的数量上限
+MAX_REGISTERS_PER_READ = 125
+
+
+def group_registers(addresses, max_gap=MAX_REGISTER_GAP):
+    """
+    把寄存器地址合并为尽量少的连续读取区间
+
+    参数:
+        addresses: 寄存器地址列表 (可重复、无序)
+        max_gap: 允许合并的最大地址间隔
+
+    返回:
+        [(起始地址, 寄存器数量), ...]，按地址升序
+    """
+    blocks = []
+    for addr in sorted(set(addresses)):
+        if blocks:
+            start, count = blocks[-1]
+            if addr - (start + count) <= max_gap and addr - start < MAX_REGISTERS_PER_READ:
+                blocks[-1] = (start, addr - start + 1)
+                continue
+        blocks.append((addr, 1))
+    return blocks
+
 
 class TemperatureHumiditySensor:
     def __init__(self, port, slave_address, baudrate=9600, parity=serial.PARITY_NONE,
-                 stopbits=1, bytesize=8, timeout=1):
+                 stopbits=1, bytesize=8, timeout=0.1, register_map=REGISTER_MAP,
+                 max_gap=MAX_REGISTER_GAP):
         """
         初始化Modbus RTU温湿度传感器
 
@@ -20,7 +65,9 @@ class TemperatureHumiditySensor:
             parity: 奇偶校验 (默认无)
             stopbits: 停止位 (默认1)
             bytesize: 数据位 (默认8)
-            timeout: 超时时间 (秒)
+            timeout: 超时时间 (秒，9600波特率下一帧应答在20ms以内，默认0.1秒足够)
+            register_map: 寄存器映射表 [(名称, 寄存器地址, 除数), ...]
+            max_gap: 合并读取时允许跨过的未映射寄存器数 (默认0，只在手册确认中间地址可读时调大)
         """
         self.port = port
         self.slave_address = slave_address
@@ -29,6 +76,11 @@ class TemperatureHumiditySensor:
         self.stopbits = stopbits
         self.bytesize = bytesize
         self.timeout = timeout
+        self.register_map = register_map
+        self._blocks = group_registers((addr for _, addr, _ in register_map), max_gap)
+
+        # 最近一次采集结果的缓存，同一周期内的多个使用者共享
+        self._cached = None
 
         # 初始化Modbus仪器
         try:
@@ -39,51 +91,76 @@ class TemperatureHumiditySensor:
             self.instrument.serial.bytesize = bytesize
             self.instrument.serial.timeout = timeout
             self.instrument.mode = minimalmodbus.MODE_RTU
+            # 每次请求前由minimalmodbus清空收发缓冲区，丢弃残留的旧字节 (库默认即为True，这里显式声明)
+            self.instrument.clear_buffers_before_each_transaction = True
+            # 同一串口总线上的请求必须串行，协程之间通过该端口的锁排队
+            self.bus_lock = _bus_locks.setdefault(port, asyncio.Lock())
             print(f"成功初始化Modbus RTU传感器在端口 {port}")
         except Exception as e:
             print(f"初始化传感器失败: {e}")
             raise
 
-    def read_temperature_humidity(self, temperature_register=0, humidity_register=1):
+    def _transaction(self, func, *args):
         """
-        读取温度和湿度值
+        执行一次Modbus请求，无应答或应答帧错误时立即重试一次
 
-        参数:
-            temperature_register: 温度寄存器地址 (根据传感器手册)
-            humidity_register: 湿度寄存器地址 (根据传感器手册)
+        帧间静默间隔和缓冲区清空由minimalmodbus负责。从站返回的异常码
+        (SlaveReportedException) 说明请求本身有误，重试没有意义，直接抛出
+        """
+        for attempt in range(2):
+            try:
+                return func(*args)
+            except (minimalmodbus.NoResponseError, minimalmodbus.InvalidResponseError):
+                if attempt:
+                    raise
+
+    def _do_read(self):
+        """
+        按寄存器映射表读取所有数据
 
         返回:
-            包含温度和湿度的字典，单位分别为摄氏度和百分比
+            以映射表中的名称为键的字典 (温度单位为摄氏度，湿度为百分比)；
+            timestamp为采集时刻的纳秒级Unix时间戳，格式化交给调用方
         """
         try:
-            # 读取温度 (通常寄存器中存储的值需要除以10或100得到实际值)
-            temperature_raw = self.instrument.read_register(40003, 1)
-            temperature = temperature_raw / 100.0  # 根据传感器手册调整除数
-
-            # 读取湿度
-            humidity_raw = self.instrument.read_register(40008, 1)
-            humidity = humidity_raw / 100.0  # 根据传感器手册调整除数
-
-            # 读取气体
-            humidity_gas = self.instrument.read_register(40003, 1)
-            gas = humidity_gas / 100.0  # 根据传感器手册调整除数
-
-            # 读取火焰
-            humidity_fire = self.instrument.read_register(2, 1)
-            fire = humidity_fire  # 根据传感器手册调整除数
-
-            return {
-                'temperature': temperature,
-                'humidity': humidity,
-                'gas': gas,
-                'fire': fire,
-                'timestamp': datetime.now().isoformat()
-            }
+            # 每个合并后的区间只发一帧请求，再按地址取出各个值
+            values = {}
+            for start, count in self._blocks:
+                regs = self._transaction(self.instrument.read_registers, start, count)
+                values.update(zip(range(start, start + count), regs))
+
+            data = {name: values[addr] / scale for name, addr, scale in self.register_map}
+            data['timestamp'] = time.time_ns()
+            return data
 
         except Exception as e:
             print(f"读取传感器数据失败: {e}")
             return None
 
+    def poll(self):
+        """
+        采集一次数据并刷新缓存
+
+        返回:
+            本次采集的数据字典，失败时为None
+        """
+        self._cached = self._do_read()
+        return self._cached
+
+    async def poll_async(self):
+        """
+        异步采集一次数据并刷新缓存
+
+        串口读写在线程池中执行，不阻塞事件循环
+        """
+        async with self.bus_lock:
+            return await asyncio.to_thread(self.poll)
+
+    @property
+    def data(self):
+        """最近一次采集的数据，不访问串口；尚未采集时为None"""
+        return self._cached
+
     def close(self):
         """关闭串口连接"""
         if hasattr(self, 'instrument') and self.instrument.serial.is_open:
@@ -91,7 +168,7 @@ class TemperatureHumiditySensor:
             print("串口连接已关闭")
 
 
-def main():
+async def main_async():
     # 配置参数 - 请根据您的实际硬件调整这些值
     # SERIAL_PORT = '/dev/ttyS1'  # 串口设备路径
     # SERIAL_PORT = '/COM6'  # 串口设备路径
@@ -112,36 +189,45 @@ def main():
         print(f"无法初始化传感器: {e}")
         return
 
-        # 使用运行标志控制循环
-    running = True
+    # 使用停止事件控制循环，收到信号时立即唤醒等待
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
 
-    def signal_handler(signum, frame):
-        nonlocal running
+    def signal_handler():
         print("接收到停止信号，正在关闭...")
-        running = False
-        # 注册信号处理
+        stop_event.set()
 
-    import signal
-    signal.signal(signal.SIGINT, signal_handler)  # Ctrl+C
-    signal.signal(signal.SIGTERM, signal_handler)  # kill命令
+    # 注册信号处理 (SIGINT: Ctrl+C, SIGTERM: kill命令)
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, signal_handler)
+        except NotImplementedError:
+            # Windows事件循环不支持add_signal_handler，退回到signal.signal
+            signal.signal(signum, lambda s, f: loop.call_soon_threadsafe(signal_handler))
+
+    # 循环内频繁使用的方法绑定为局部变量，省去每轮的属性查找
+    poll = sensor.poll_async
+    fromtimestamp = datetime.fromtimestamp
+    wait_for = asyncio.wait_for
 
     try:
-        while running:
-            data = sensor.read_temperature_humidity()
-            time_str = datetime.now().strftime("%Y%m%d_%H%M%S")
-            print(time_str)
+        while not stop_event.is_set():
+            data = await poll()
             if data:
+                print(fromtimestamp(data['timestamp'] / 1e9).strftime("%Y%m%d_%H%M%S"))
                 print(
                     f"温度: {data['temperature']:.1f}°C, 湿度: {data['humidity']:.1f}%, 气体: {data['gas']:.1f}%, 火焰: {data['fire']:.1f}")
             else:
+                print(now().strftime("%Y%m%d_%H%M%S"))
                 print("未能读取到有效数据")
-                running = False
+                break
 
-            # 使用更优雅的等待方式
-            for _ in range(POLL_INTERVAL * 10):
-                if not running:
-                    break
-                time.sleep(0.1)
+            # 等待下一次采集，收到停止信号时提前返回
+            try:
+                await wait_for(stop_event.wait(), POLL_INTERVAL)
+                break
+            except asyncio.TimeoutError:
+                pass
 
     except Exception as e:
         print(f"程序运行出错: {e}")
@@ -150,5 +236,9 @@ def main():
         print("传感器采集程序已正常退出")
 
 
+def main():
+    asyncio.run(main_async())
+
+
 if __name__ == "__main__":
     main()
@@ -1,11 +1,18 @@
 #!/usr/bin/env python3
 # github_poller.py
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 import subprocess
 import time
 import json
+import hashlib
 import logging
+import logging.handlers
 import os
+import queue
+import shutil
+import signal
 import sys
 from datetime import datetime
 import argparse
@@ -23,26 +30,55 @@ class GitHubAutoUpdater:
         self.retry_delay = config.get('retry_delay', 10)
         self.check_service = config['check_service']
         self.beifen_path = config['beifen_path']
+        self.cache_dir = config.get('cache_dir', os.path.expanduser('~/.cache/github_poller'))
+        self.log_file = config['log_file']
         # 设置日志
-        self.setup_logging(config['log_file'])
+        self.setup_logging(self.log_file)
 
         # 初始化状态
         self.last_commit = self.get_local_commit()
         self.update_count = 0
         self.last_check = None
 
+        # 条件请求缓存: 分支未变化时GitHub返回304，不消耗API配额
+        self._etag = None
+        self._last_remote_sha = None
+
+        # 每次更新时缓存一次项目根目录列表，检查文件是否存在时不再逐个stat
+        self._project_files = None
+
+        # 复用同一个会话保持与api.github.com的长连接，省去每次的TLS握手
+        self.session = requests.Session()
+        self.session.headers.update(self.get_headers())
+        self.session.mount('https://', HTTPAdapter(max_retries=Retry(total=3, backoff_factor=1)))
+
+        # 启动时一次性获取已安装的systemd服务，重启时不再逐个查询
+        self._known_units = self.get_known_units()
+
     def setup_logging(self, log_file):
         """配置日志系统"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file),
-                logging.StreamHandler(sys.stdout)
-            ]
-        )
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        handlers = [
+            logging.FileHandler(log_file),
+            logging.StreamHandler(sys.stdout)
+        ]
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        # 日志调用只入队，由后台线程写文件和终端，磁盘慢时不阻塞主循环
+        log_queue = queue.Queue(-1)
+        root = logging.getLogger()
+        root.setLevel(logging.INFO)
+        root.addHandler(logging.handlers.QueueHandler(log_queue))
+        self.log_listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+        self.log_listener.start()
+
         self.logger = logging.getLogger('GitHubPoller')
 
+    def stop_logging(self):
+        """停止后台日志线程，写出队列中剩余的日志"""
+        self.log_listener.stop()
+
     def get_headers(self):
         """获取API请求头"""
         headers = {'Accept': 'application/vnd.github.v3+json'}
@@ -70,17 +106,57 @@ class GitHubAutoUpdater:
             self.logger.error(f"获取本地commit异常: {e}")
             return None
 
+    def log_api_error(self, response):
+        """记录GitHub API的错误响应"""
+        if response.status_code == 404:
+            self.logger.error(f"分支不存在: {self.branch}")
+        elif response.status_code == 403:
+            self.logger.warning("API速率限制，考虑使用GitHub Token")
+        else:
+            self.logger.error(f"API请求失败: {response.status_code}")
+
+    def get_remote_sha(self):
+        """获取远程分支最新commit hash (纯文本响应，无需解析JSON)"""
+        url = f"https://api.github.com/repos/{self.owner}/{self.repo}/commits/{self.branch}"
+
+        try:
+            headers = {'Accept': 'application/vnd.github.sha'}
+            if self._etag:
+                headers['If-None-Match'] = self._etag
+            response = self.session.get(url, headers=headers, timeout=10)
+
+            # GitHub通过X-Poll-Interval给出建议的最小轮询间隔
+            poll_hint = response.headers.get('X-Poll-Interval')
+            if poll_hint and poll_hint.isdigit() and int(poll_hint) > self.poll_interval:
+                self.logger.info(f"按GitHub建议调整检查间隔: {poll_hint}秒")
+                self.poll_interval = int(poll_hint)
+
+            if response.status_code == 304 and self._last_remote_sha:
+                self.logger.info("远程未变化 (304)")
+                return self._last_remote_sha
+            elif response.status_code == 200:
+                self.logger.info(f"获取远程成功")
+                self._etag = response.headers.get('ETag')
+                self._last_remote_sha = response.text.strip()
+                return self._last_remote_sha
+            else:
+                self.log_api_error(response)
+
+        except requests.RequestException as e:
+            self.logger.error(f"网络请求异常: {e}")
+
+        return None
+
     def get_remote_commit_info(self):
         """获取远程仓库最新commit信息"""
         url = f"https://api.github.com/repos/{self.owner}/{self.repo}/branches/{self.branch}"
 
         try:
-            response = requests.get(url, headers=self.get_headers(), timeout=10)
+            response = self.session.get(url, timeout=10)
 
             if response.status_code == 200:
                 data = response.json()
                 commit = data['commit']
-                self.logger.info(f"获取远程成功")
                 return {
                     'sha': commit['sha'],
                     'message': commit['commit']['message'],
@@ -88,12 +164,8 @@ class GitHubAutoUpdater:
                     'date': commit['commit']['author']['date'],
                     'url': commit['html_url']
                 }
-            elif response.status_code == 404:
-                self.logger.error(f"分支不存在: {self.branch}")
-            elif response.status_code == 403:
-                self.logger.warning("API速率限制，考虑使用GitHub Token")
             else:
-                self.logger.error(f"API请求失败: {response.status_code}")
+                self.log_api_error(response)
 
         except requests.RequestException as e:
             self.logger.error(f"网络请求异常: {e}")
@@ -104,42 +176,47 @@ class GitHubAutoUpdater:
         """检查是否有可用更新"""
         self.last_check = datetime.now()
 
-        remote_commit_info = self.get_remote_commit_info()
-        if not remote_commit_info:
+        # 先只比较commit hash，确认有更新后才获取完整的commit信息
+        remote_commit = self.get_remote_sha()
+        if not remote_commit:
             return False, None
 
-        remote_commit = remote_commit_info['sha']
-        local_commit = self.get_local_commit()
+        # 本地commit只会在拉取代码后变化，使用缓存值避免每次都启动git进程
+        if not self.last_commit:
+            self.last_commit = self.get_local_commit()
+        local_commit = self.last_commit
 
         if not local_commit:
             self.logger.warning("无法获取本地commit，跳过检查")
-            return False, remote_commit_info
+            return False, None
+
+        if remote_commit == local_commit:
+            self.logger.debug("没有检测到更新")
+            return False, None
 
-        # 比较commit hash
-        if remote_commit != local_commit:
-            self.logger.info(f"检测到更新: {local_commit[:8]} -> {remote_commit[:8]}")
-            self.logger.info(f"提交信息: {remote_commit_info['message']}")
-            return True, remote_commit_info
+        remote_commit_info = self.get_remote_commit_info()
+        if not remote_commit_info:
+            return False, None
 
-        self.logger.debug("没有检测到更新")
-        return False, remote_commit_info
+        self.logger.info(f"检测到更新: {local_commit[:8]} -> {remote_commit_info['sha'][:8]}")
+        self.logger.info(f"提交信息: {remote_commit_info['message']}")
+        return True, remote_commit_info
 
     def fetch_latest_code(self):
         """获取最新代码"""
         commands = [
-            'git fetch origin',
-            f'git checkout {self.branch}',
-            f'git reset --hard origin/{self.branch}'
+            ['git', 'fetch', 'origin'],
+            ['git', 'checkout', self.branch],
+            ['git', 'reset', '--hard', f'origin/{self.branch}']
         ]
 
         for i, cmd in enumerate(commands):
             for attempt in range(self.max_retries):
                 try:
-                    self.logger.info(f"执行命令: {cmd} (尝试 {attempt + 1}/{self.max_retries})")
+                    self.logger.info(f"执行命令: {' '.join(cmd)} (尝试 {attempt + 1}/{self.max_retries})")
 
                     result = subprocess.run(
                         cmd,
-                        shell=True,
                         cwd=self.project_path,
                         capture_output=True,
                         text=True,
@@ -166,11 +243,41 @@ class GitHubAutoUpdater:
 
         return True
 
+    def project_has(self, name):
+        """检查项目根目录下是否存在指定文件"""
+        if self._project_files is None:
+            return os.path.exists(os.path.join(self.project_path, name))
+        return name in self._project_files
+
+    def load_reqs_hash(self):
+        """读取上次成功安装时requirements.txt的哈希"""
+        try:
+            with open(os.path.join(self.cache_dir, 'reqs.sha256'), 'r') as f:
+                return f.read().strip()
+        except OSError:
+            return None
+
+    def save_reqs_hash(self, reqs_hash):
+        """记录本次成功安装的requirements.txt哈希"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(os.path.join(self.cache_dir, 'reqs.sha256'), 'w') as f:
+                f.write(reqs_hash)
+        except OSError as e:
+            self.logger.warning(f"保存依赖哈希失败: {e}")
+
     def install_dependencies(self):
         """安装依赖"""
         requirements_file = os.path.join(self.project_path, 'requirements.txt')
 
-        if os.path.exists(requirements_file):
+        if self.project_has('requirements.txt'):
+            # requirements.txt未变化时无需重新执行pip
+            with open(requirements_file, 'rb') as f:
+                reqs_hash = hashlib.sha256(f.read()).hexdigest()
+            if reqs_hash == self.load_reqs_hash():
+                self.logger.info("requirements.txt未变化，跳过依赖安装")
+                return True
+
             self.logger.info("安装Python依赖...")
 
             for attempt in range(self.max_retries):
@@ -186,6 +293,7 @@ class GitHubAutoUpdater:
 
                     self.logger.info("依赖安装成功")
                     self.logger.debug(f"安装输出: {result.stdout}")
+                    self.save_reqs_hash(reqs_hash)
                     return True
 
                 except subprocess.CalledProcessError as e:
@@ -206,20 +314,19 @@ class GitHubAutoUpdater:
     def run_custom_scripts(self):
         """运行自定义部署脚本"""
         scripts = [
-            {'name': '数据库迁移', 'command': 'python manage.py migrate', 'check_file': 'manage.py'},
-            {'name': '静态文件收集', 'command': 'python manage.py collectstatic --noinput', 'check_file': 'manage.py'},
-            {'name': '单元测试', 'command': 'python -m pytest tests/', 'check_file': 'pytest.ini'}
+            {'name': '数据库迁移', 'command': ['python', 'manage.py', 'migrate'], 'check_file': 'manage.py'},
+            {'name': '静态文件收集', 'command': ['python', 'manage.py', 'collectstatic', '--noinput'],
+             'check_file': 'manage.py'},
+            {'name': '单元测试', 'command': ['python', '-m', 'pytest', 'tests/'], 'check_file': 'pytest.ini'}
         ]
 
         for script in scripts:
-            check_file = os.path.join(self.project_path, script['check_file'])
-            if os.path.exists(check_file):
+            if self.project_has(script['check_file']):
                 self.logger.info(f"执行{script['name']}...")
 
                 try:
                     result = subprocess.run(
                         script['command'],
-                        shell=True,
                         cwd=self.project_path,
                         capture_output=True,
                         text=True,
@@ -230,27 +337,39 @@ class GitHubAutoUpdater:
                 except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
                     self.logger.warning(f"{script['name']}执行失败: {e}")
 
+    def get_known_units(self):
+        """获取系统中已安装的systemd服务单元"""
+        try:
+            output = subprocess.check_output(
+                ['systemctl', 'list-unit-files', '--type=service', '--no-legend'],
+                text=True,
+                timeout=30
+            )
+            return set(output.split())
+        except (OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+            self.logger.warning(f"获取systemd服务列表失败: {e}")
+            return set()
+
     def restart_application(self):
         """重启应用服务"""
         services = [self.check_service]
 
+        # 只重启系统中存在的服务
         for service in services:
+            # 配置中的服务名可以带或不带.service后缀
+            unit = service if service.endswith('.service') else f"{service}.service"
+            if unit not in self._known_units:
+                self.logger.warning(f"服务不存在，跳过重启: {service}")
+                continue
+
             try:
-                # 检查服务是否存在
-                result = subprocess.run(
-                    ['systemctl', 'status', service],
-                    capture_output=True,
-                    text=True
+                self.logger.info(f"重启服务: {service}")
+                subprocess.run(
+                    ['sudo', 'systemctl', 'restart', service],
+                    check=True,
+                    timeout=30
                 )
-
-                if result.returncode == 0:
-                    self.logger.info(f"重启服务: {service}")
-                    subprocess.run(
-                        ['sudo', 'systemctl', 'restart', service],
-                        check=True,
-                        timeout=30
-                    )
-                    self.logger.info(f"服务 {service} 重启成功")
+                self.logger.info(f"服务 {service} 重启成功")
 
             except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
                 self.logger.error(f"服务 {service} 重启失败: {e}")
@@ -262,10 +381,40 @@ class GitHubAutoUpdater:
             backup_dir = f"/{self.beifen_path}/_{timestamp}"
             self.logger.info(f"创建备份: {backup_dir}")
             os.makedirs(backup_dir, exist_ok=True)
-            subprocess.run(
-                ['cp', '-r', self.project_path, backup_dir],
-                check=True
-            )
+
+            project_path = os.path.abspath(self.project_path)
+            target = os.path.join(backup_dir, os.path.basename(project_path))
+
+            # 不备份缓存文件；日志文件在项目目录内时会持续追加，也不放进备份
+            excludes = ['__pycache__']
+            log_file = os.path.abspath(self.log_file)
+            if log_file.startswith(project_path + os.sep):
+                excludes.append('/' + os.path.relpath(log_file, project_path))
+
+            # 硬链接快照: 未变化的文件与项目共享inode，几乎不占额外空间
+            # (git检出时会新建文件而不是原地改写，所以备份中的旧版本不受影响)
+            try:
+                result = subprocess.run(
+                    ['rsync', '-a', f'--link-dest={project_path}',
+                     *(f'--exclude={pattern}' for pattern in excludes),
+                     f'{project_path}/', f'{target}/'],
+                    capture_output=True,
+                    text=True
+                )
+                error = result.stderr.strip() if result.returncode != 0 else None
+            except OSError as e:
+                error = str(e)
+
+            if error is not None:
+                # 未安装rsync或链接失败时退回完整复制
+                self.logger.warning(f"硬链接备份失败，改为完整复制: {error}")
+                shutil.rmtree(target, ignore_errors=True)
+                shutil.copytree(
+                    project_path,
+                    target,
+                    symlinks=True,
+                    ignore=shutil.ignore_patterns('__pycache__', os.path.basename(log_file))
+                )
             return True
         except Exception as e:
             self.logger.error(f"备份创建失败: {e}")
@@ -283,20 +432,25 @@ class GitHubAutoUpdater:
         if not self.fetch_latest_code():
             self.logger.error("代码更新失败")
             return False
+        self.last_commit = self.get_local_commit()
+        self._project_files = set(os.listdir(self.project_path))
 
-        # 3. 安装依赖
-        if not self.install_dependencies():
-            self.logger.error("依赖安装失败")
-            return False
+        try:
+            # 3. 安装依赖
+            if not self.install_dependencies():
+                self.logger.error("依赖安装失败")
+                return False
 
-        # 4. 运行自定义脚本
-        # self.run_custom_scripts()
+            # 4. 运行自定义脚本
+            # self.run_custom_scripts()
 
-        # 5. 重启应用
-        self.restart_application()
+            # 5. 重启应用
+            self.restart_application()
+        finally:
+            # 目录列表只在本次更新内有效
+            self._project_files = None
 
-        # 6. 更新本地commit记录
-        self.last_commit = commit_info['sha']
+        # 6. 更新计数
         self.update_count += 1
 
         self.logger.info(f"更新完成! 总共更新次数: {self.update_count}")
@@ -325,30 +479,36 @@ Commit: {commit_info['sha'][:8]}
         self.logger.info(f"项目路径: {self.project_path}")
         self.logger.info(f"检查间隔: {self.poll_interval}秒")
 
+        # 循环内频繁使用的方法绑定为局部变量，省去每轮的属性查找
+        log_info = self.logger.info
+        log_error = self.logger.error
+        sleep = time.sleep
+        has_update_available = self.has_update_available
+
         try:
             while True:
                 try:
-                    has_update, commit_info = self.has_update_available()
+                    has_update, commit_info = has_update_available()
 
                     if has_update and commit_info:
-                        self.logger.info(f"开始处理更新: {commit_info['message']}")
+                        log_info(f"开始处理更新: {commit_info['message']}")
 
                         success = self.perform_update(commit_info)
                         self.send_notification(commit_info, success)
 
                         if not success:
-                            self.logger.error("更新失败，将在下次检查时重试")
+                            log_error("更新失败，将在下次检查时重试")
                     else:
-                        self.logger.info("GitHub没有更新的版本")
+                        log_info("GitHub没有更新的版本")
                     # 等待下一次检查
-                    time.sleep(self.poll_interval)
+                    sleep(self.poll_interval)
 
                 except KeyboardInterrupt:
-                    self.logger.info("收到中断信号，停止运行")
+                    log_info("收到中断信号，停止运行")
                     break
                 except Exception as e:
-                    self.logger.error(f"主循环异常: {e}")
-                    time.sleep(self.poll_interval)
+                    log_error(f"主循环异常: {e}")
+                    sleep(self.poll_interval)
 
         except Exception as e:
             self.logger.error(f"运行异常: {e}")
@@ -368,7 +528,8 @@ def load_config(config_file=None):
         'github_token': os.getenv('GITHUB_TOKEN'),
         'check_service': 'myservice',
         'log_file': '/home/admin/test/github_poller.log',
-        'beifen_path': '/home/admin/beifen'
+        'beifen_path': '/home/admin/beifen',
+        'cache_dir': '/home/admin/.cache/github_poller'
     }
 
     if config_file and os.path.exists(config_file):
@@ -396,17 +557,26 @@ def main():
     # 创建更新器实例
     updater = GitHubAutoUpdater(config)
 
-    if args.once:
-        # 单次检查模式
-        has_update, commit_info = updater.has_update_available()
-        if has_update:
-            print(f"检测到更新: {commit_info['message']}")
-            updater.perform_update(commit_info)
+    # systemctl stop/restart发送SIGTERM，转为SystemExit以便执行finally，写出队列中剩余的日志
+    def handle_sigterm(signum, frame):
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+    try:
+        if args.once:
+            # 单次检查模式
+            has_update, commit_info = updater.has_update_available()
+            if has_update:
+                print(f"检测到更新: {commit_info['message']}")
+                updater.perform_update(commit_info)
+            else:
+                print("没有检测到更新")
         else:
-            print("没有检测到更新")
-    else:
-        # 持续运行模式
-        updater.run()
+            # 持续运行模式
+            updater.run()
+    finally:
+        updater.stop_logging()
 
 
 if __name__ == "__main__":
@@ -3,16 +3,16 @@
 import serial.tools.list_ports
 def get_available_ports():
     """获取所有可用的串口列表"""
-    ports = serial.tools.list_ports.comports()
-    port_list = []
+    ports = sorted(serial.tools.list_ports.comports())
+    port_list = [
+        {'port': p.device, 'description': p.description, 'hardware_id': p.hwid}
+        for p in ports
+    ]
 
-    for port, desc, hwid in sorted(ports):
-        port_list.append({
-            'port': port,
-            'description': desc,
-            'hardware_id': hwid
-        })
-        print(f"端口: {port}, 描述: {desc}, 硬件ID: {hwid}")
+    if port_list:
+        print('\n'.join(
+            f"端口: {p['port']}, 描述: {p['description']}, 硬件ID: {p['hardware_id']}" for p in port_list
+        ))
 
     return port_list
 